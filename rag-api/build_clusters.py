@@ -0,0 +1,163 @@
+"""
+Offline job: cluster stored log vectors and pre-generate one explanation
+per cluster. Run off-peak inside the API container.
+"""
+
+import json
+import time
+from collections import Counter
+
+import numpy as np
+
+import app
+from shards import index_files, load_index
+
+# ---------------- CONFIG ----------------
+
+N_CLUSTERS = 40
+BATCH_SIZE = 256
+N_ITERATIONS = 100
+REPRESENTATIVES = 3
+SEED = 42
+
+# ---------------------------------------
+
+
+def init_centers(vectors, k, rng):
+    """
+    k-means++ seeding on unit vectors (cosine distance).
+    """
+    n = len(vectors)
+    centers = [vectors[rng.integers(n)]]
+    dist = 1.0 - vectors @ centers[0]
+
+    for _ in range(1, k):
+        weights = np.clip(dist, 0, None)
+        total = weights.sum()
+        if total <= 0:
+            idx = rng.integers(n)
+        else:
+            idx = rng.choice(n, p=weights / total)
+        centers.append(vectors[idx])
+        np.minimum(dist, 1.0 - vectors @ vectors[idx], out=dist)
+
+    return np.array(centers, dtype=np.float32)
+
+
+def minibatch_kmeans(vectors, k, batch_size, iterations, seed):
+    """
+    Spherical mini-batch k-means (Sculley, 2010) with per-center
+    learning rates. Returns (centers, labels).
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    k = min(k, n)
+
+    centers = init_centers(vectors, k, rng)
+    counts = np.zeros(k)
+
+    for _ in range(iterations):
+        batch = vectors[rng.choice(n, size=min(batch_size, n), replace=False)]
+        nearest = np.argmax(batch @ centers.T, axis=1)
+
+        for c in np.unique(nearest):
+            members = batch[nearest == c]
+            counts[c] += len(members)
+            lr = len(members) / counts[c]
+            centers[c] = (1.0 - lr) * centers[c] + lr * members.mean(axis=0)
+
+        norms = np.linalg.norm(centers, axis=1, keepdims=True)
+        centers /= np.where(norms == 0, 1.0, norms)
+
+    labels = np.argmax(vectors @ centers.T, axis=1)
+    return centers, labels
+
+
+def load_corpus():
+    """
+    The API's resident index, or every shard file when the API searches
+    shards (importing the app never starts shard workers).
+    """
+    if len(app.VECTORS):
+        return app.STORE, app.VECTORS
+    return load_index(index_files(app.VECTORS_FILE), app.EMBEDDING_DIM)
+
+
+def describe_cluster(store, vectors, members, center):
+    """
+    Pick the events closest to the centroid and a human-readable label
+    (the most common message in the cluster).
+    """
+    sims = vectors[members] @ center
+    reps = members[np.argsort(-sims)[:REPRESENTATIVES]]
+
+    messages = Counter(
+        store.field("message", i) or "" for i in members
+    )
+    label = messages.most_common(1)[0][0]
+
+    return reps, label
+
+
+def explain_cluster(store, reps, label):
+    safe_label = app.sanitize_text(label)[: app.QUERY_TOKEN_LIMIT * app.CHARS_PER_TOKEN]
+    context = app.pack_context(
+        [app.build_context_entry(store.metadata(i)) for i in reps],
+        app.CONTEXT_TOKEN_BUDGET - app.estimate_tokens(safe_label)
+    )
+    return app.generate_explanation(app.build_prompt(context, safe_label))
+
+
+def main():
+    store, vectors = load_corpus()
+    if len(vectors) == 0:
+        print("No vectors found — stopping.")
+        return
+
+    centers, labels = minibatch_kmeans(
+        vectors, N_CLUSTERS, BATCH_SIZE, N_ITERATIONS, SEED
+    )
+    print(f"Clustered {len(vectors)} vectors into {len(centers)} clusters")
+
+    llm_available = app.is_ollama_available()
+    if not llm_available:
+        print("⚠️ Ollama not reachable — writing clusters without explanations")
+
+    clusters = []
+    for c, center in enumerate(centers):
+        members = np.flatnonzero(labels == c)
+        if len(members) == 0:
+            continue
+
+        reps, label = describe_cluster(store, vectors, members, center)
+
+        explanation = None
+        if llm_available:
+            output, error = explain_cluster(store, reps, label)
+            if error:
+                print(f"Cluster {c}: {error}")
+            else:
+                explanation = output.strip()
+
+        clusters.append({
+            "id": c,
+            "size": int(len(members)),
+            "label": label,
+            "representatives": [store.record_id(i) for i in reps],
+            "centroid": center.tolist(),
+            "explanation": explanation,
+        })
+        print(f"Cluster {c}: {len(members)} logs — {label}")
+
+    with open(app.CLUSTERS_FILE, "w", encoding="utf-8") as out:
+        json.dump({
+            "model": app.OLLAMA_MODEL,
+            "created": time.time(),
+            "clusters": clusters,
+        }, out)
+
+    print(f"Wrote clusters → {app.CLUSTERS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
-import json
 import uuid
 import re
-from sentence_transformers import SentenceTransformer
+
+from shards import build_index
 
 LOG_FILE_PATH = r"C:\Users\User\Desktop\lograg\sample_logs\app.log"
 OUTPUT_FILE = r"C:\Users\User\Desktop\lograg\data\logs_vectors.jsonl"
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+N_SHARDS = 1          # >1 writes shard-NN.jsonl files next to OUTPUT_FILE
+SHARD_BY = "hash"     # "hash" (record id) or "service"
+BUILD_WORKERS = 1     # processes embedding shards in parallel
+BATCH_SIZE = 64
 
 LOG_PATTERN = re.compile(
     r"^(?P<date>\d{4}-\d{2}-\d{2})\s+"
@@ -45,7 +48,7 @@ def parse_logs(path):
     return events
 
 
-def embed_event(event):
+def event_text(event):
     """
     Build a rich semantic document for embedding.
     This dramatically improves retrieval quality.
@@ -65,8 +68,7 @@ Stack Trace:
 {event.get('stack', '')}
 """.strip()
 
-    return model.encode(text).tolist()
-
+    return text
 
 
 def main():
@@ -76,16 +78,15 @@ def main():
     if not events:
         return
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as out:
-        for event in events:
-            record = {
-                "id": str(uuid.uuid4()),
-                "vector": embed_event(event),
-                "metadata": event
-            }
-            out.write(json.dumps(record) + "\n")
+    records = [(str(uuid.uuid4()), event) for event in events]
+
+    written = build_index(
+        OUTPUT_FILE, records, event_text,
+        N_SHARDS, SHARD_BY, BUILD_WORKERS, BATCH_SIZE,
+    )
 
-    print(f"Wrote vectors to {OUTPUT_FILE}")
+    for path, count in written:
+        print(f"Wrote {count} vectors to {path}")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,18 @@
 import json
 import uuid
-from sentence_transformers import SentenceTransformer
+
+from shards import build_index
 
 INPUT_FILE = r"C:\Users\User\Desktop\lograg\ingestion\synthetic_logs.json"
 OUTPUT_FILE = r"C:\Users\User\Desktop\lograg\data\logs_index\data.jsonl"
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+N_SHARDS = 1          # >1 writes shard-NN.jsonl files next to OUTPUT_FILE
+SHARD_BY = "hash"     # "hash" (record id) or "service"
+BUILD_WORKERS = 1     # processes embedding shards in parallel
+BATCH_SIZE = 64
 
 
-def embed_log(log):
+def log_text(log):
     """
     Build rich semantic text for embedding
     """
@@ -30,7 +34,7 @@ Stack Trace:
 {log.get('stack', '')}
 """.strip()
 
-    return model.encode(text).tolist()
+    return text
 
 
 def main():
@@ -39,16 +43,15 @@ def main():
 
     print(f"Loaded {len(logs)} synthetic logs")
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as out:
-        for log in logs:
-            record = {
-                "id": str(uuid.uuid4()),
-                "vector": embed_log(log),
-                "metadata": log
-            }
-            out.write(json.dumps(record) + "\n")
+    records = [(str(uuid.uuid4()), log) for log in logs]
+
+    written = build_index(
+        OUTPUT_FILE, records, log_text,
+        N_SHARDS, SHARD_BY, BUILD_WORKERS, BATCH_SIZE,
+    )
 
-    print(f"Wrote vectors → {OUTPUT_FILE}")
+    for path, count in written:
+        print(f"Wrote {count} vectors → {path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+import json
+import sys
+from array import array
+
+import numpy as np
+
+# ---------------- LAYOUT ----------------
+
+# Low-cardinality fields: dictionary-encoded (one small int per record)
+CATEGORICAL_FIELDS = ("service", "level", "host", "source", "component", "layer")
+
+# Free-text fields: packed into one UTF-8 blob per field with offsets
+TEXT_FIELDS = ("timestamp", "message", "stack")
+
+# ---------------------------------------
+
+
+class StringTable:
+    """
+    Append-only table of strings stored as a single UTF-8 blob plus
+    offsets. Strings are only decoded when accessed.
+    """
+
+    __slots__ = ("_blob", "_offsets")
+
+    def __init__(self):
+        self._blob = bytearray()
+        self._offsets = array("q", [0])
+
+    def append(self, text: str):
+        self._blob += text.encode("utf-8")
+        self._offsets.append(len(self._blob))
+
+    def freeze(self):
+        self._blob = bytes(self._blob)
+        self._offsets = np.frombuffer(self._offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def nbytes(self) -> int:
+        return len(self._blob) + len(self._offsets) * 8
+
+
+class CategoricalColumn:
+    """
+    Dictionary-encoded string column. Each distinct value is stored
+    once; records hold a 16-bit code (index 0 means missing), widened
+    to 32 bits if the column outgrows that.
+    """
+
+    __slots__ = ("_codes", "_values", "_lookup")
+
+    def __init__(self):
+        self._codes = array("H")
+        self._values = [None]
+        self._lookup = {}
+
+    def append(self, value):
+        if value is None:
+            self._codes.append(0)
+            return
+
+        code = self._lookup.get(value)
+        if code is None:
+            code = len(self._values)
+            if code > 0xFFFF and self._codes.typecode == "H":
+                self._codes = array("I", self._codes)
+            self._values.append(value)
+            self._lookup[value] = code
+        self._codes.append(code)
+
+    def freeze(self):
+        self._codes = np.frombuffer(self._codes, dtype=self._codes.typecode)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __getitem__(self, i: int):
+        return self._values[self._codes[i]]
+
+    def nbytes(self) -> int:
+        # Codes plus the value dictionary (strings, list and lookup dict)
+        return (
+            self._codes.itemsize * len(self._codes)
+            + sum(sys.getsizeof(v) for v in self._values if v is not None)
+            + sys.getsizeof(self._values)
+            + sys.getsizeof(self._lookup)
+        )
+
+
+class RecordStore:
+    """
+    Columnar store for log record ids and metadata.
+    Per-record dicts are only materialised for returned results.
+    """
+
+    def __init__(self):
+        self._ids = StringTable()
+        self._categorical = {name: CategoricalColumn() for name in CATEGORICAL_FIELDS}
+        self._text = {name: StringTable() for name in TEXT_FIELDS}
+        self._text_present = array("B")
+        # Any other field (tags, non-string values) as compact JSON, "" if none
+        self._extra = StringTable()
+
+    def append(self, record_id: str, metadata: dict):
+        remaining = dict(metadata)
+        self._ids.append(record_id)
+
+        for name, column in self._categorical.items():
+            value = remaining.get(name)
+            if isinstance(value, str):
+                column.append(value)
+                del remaining[name]
+            else:
+                column.append(None)
+
+        present = 0
+        for bit, (name, table) in enumerate(self._text.items()):
+            value = remaining.get(name)
+            if isinstance(value, str):
+                table.append(value)
+                present |= 1 << bit
+                del remaining[name]
+            else:
+                table.append("")
+        self._text_present.append(present)
+
+        self._extra.append(
+            json.dumps(remaining, separators=(",", ":")) if remaining else ""
+        )
+
+    def freeze(self):
+        """
+        Convert the append buffers to read-only NumPy arrays / bytes.
+        """
+        self._ids.freeze()
+        for column in self._categorical.values():
+            column.freeze()
+        for table in self._text.values():
+            table.freeze()
+        self._text_present = np.frombuffer(self._text_present, dtype=np.uint8)
+        self._extra.freeze()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def record_id(self, i: int) -> str:
+        return self._ids[i]
+
+    def field(self, name: str, i: int):
+        if name in self._categorical:
+            return self._categorical[name][i]
+
+        if name in self._text:
+            bit = TEXT_FIELDS.index(name)
+            if self._text_present[i] & (1 << bit):
+                return self._text[name][i]
+            return None
+
+        return self.metadata(i).get(name)
+
+    def metadata(self, i: int) -> dict:
+        meta = {}
+
+        for name, column in self._categorical.items():
+            value = column[i]
+            if value is not None:
+                meta[name] = value
+
+        present = self._text_present[i]
+        for bit, (name, table) in enumerate(self._text.items()):
+            if present & (1 << bit):
+                meta[name] = table[i]
+
+        extra = self._extra[i]
+        if extra:
+            meta.update(json.loads(extra))
+
+        return meta
+
+    def nbytes(self) -> int:
+        return (
+            self._ids.nbytes()
+            + sum(c.nbytes() for c in self._categorical.values())
+            + sum(t.nbytes() for t in self._text.values())
+            + len(self._text_present)
+            + self._extra.nbytes()
+        )
+
+
+def load_records(paths, dim: int):
+    """
+    Stream one or more vectors JSONL files into a RecordStore and a
+    float32 matrix without keeping the parsed records (or their boxed
+    floats) around.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    store = RecordStore()
+    vectors = np.empty((1024, dim), dtype=np.float32)
+    n = 0
+
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                record = json.loads(line)
+
+                if n == len(vectors):
+                    grown = np.empty((2 * len(vectors), dim), dtype=np.float32)
+                    grown[:n] = vectors
+                    vectors = grown
+
+                vectors[n] = record["vector"]
+                store.append(record["id"], record["metadata"])
+                n += 1
+
+    store.freeze()
+    return store, vectors[:n].copy()
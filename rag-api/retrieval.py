@@ -0,0 +1,140 @@
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    Unit-normalise in place so cosine similarity is a plain dot product.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1.0, norms)
+    return vectors
+
+
+def collapse_duplicates(vectors: np.ndarray, threshold: float, chunk: int = 1024):
+    """
+    Greedily group candidates (ordered by relevance): each joins the
+    first earlier representative it is threshold-similar to, or becomes
+    one itself. Returns the representative positions.
+    Only candidate/representative similarities are computed, so a pool
+    dominated by one incident stays cheap however large it grows.
+    """
+    reps = []
+
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk]
+        fresh = np.ones(len(block), dtype=bool)
+        if reps:
+            fresh &= ((block @ vectors[reps].T) < threshold).all(axis=1)
+
+        block_sims = block @ block.T
+        for i in range(len(block)):
+            if fresh[i]:
+                reps.append(start + i)
+                fresh[i + 1:] &= block_sims[i, i + 1:] < threshold
+
+    return np.array(reps, dtype=np.int64)
+
+
+def mmr_select(relevance: np.ndarray, cand_sims: np.ndarray, k: int, lam: float, seed=()):
+    """
+    Maximal marginal relevance over a candidate pool.
+    Picks k positions trading relevance against similarity to what
+    has already been selected. A seed (earlier picks) is kept as the
+    prefix, so a ranking can be extended without reordering it.
+    """
+    n = relevance.shape[0]
+    k = min(k, n)
+
+    selected = list(seed) or [int(np.argmax(relevance))]
+    max_sim = cand_sims[selected].max(axis=0)
+    available = np.ones(n, dtype=bool)
+    available[selected] = False
+
+    while len(selected) < k:
+        mmr = lam * relevance - (1.0 - lam) * max_sim
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_sim, cand_sims[best], out=max_sim)
+
+    return selected
+
+
+def rank_candidates(scores, vectors, k, lam, threshold, seed=()):
+    """
+    Collapse near-duplicates and MMR re-rank candidates that are already
+    sorted by descending score. seed holds positions picked by an earlier,
+    shallower ranking; they stay first. Returns the picked positions.
+    """
+    if len(scores) == 0:
+        return []
+
+    reps = collapse_duplicates(vectors, threshold)
+    rep_vectors = vectors[reps]
+    rep_sims = rep_vectors @ rep_vectors.T
+
+    # Greedy collapsing is prefix-stable, so earlier picks are still reps
+    rep_of = {int(p): j for j, p in enumerate(reps)}
+    seed = [rep_of[p] for p in seed if p in rep_of]
+    picked = mmr_select(scores[reps], rep_sims, k, lam, seed)
+
+    return [int(reps[p]) for p in picked]
+
+
+def count_near(vectors, targets, threshold, chunk=65536):
+    """
+    For each target, how many rows are at least threshold-similar to it
+    (the target's own row included). Scans in chunks to bound memory.
+    """
+    counts = np.zeros(len(targets), dtype=np.int64)
+    if len(vectors) == 0 or len(targets) == 0:
+        return counts
+
+    for start in range(0, len(vectors), chunk):
+        sims = vectors[start:start + chunk] @ targets.T
+        counts += (sims >= threshold).sum(axis=0)
+    return counts
+
+
+def pool_size_for(k: int, pool_size: int) -> int:
+    # Deep pages need a pool larger than k so duplicates can collapse
+    return max(pool_size, 2 * k)
+
+
+def top_candidates(scores, pool):
+    """
+    Indices of the pool best-scoring rows, best first.
+    """
+    pool = min(pool, len(scores))
+    cand = np.argpartition(-scores, pool - 1)[:pool]
+    return cand[np.argsort(-scores[cand])]
+
+
+def search_matrix(vectors, query_vec, k, lam, pool_size, threshold, seed=()):
+    """
+    Score every row and re-rank the top candidates, keeping the seed row
+    indices (an earlier ranking) as the prefix. While the pool collapses
+    into fewer than k distinct events it is doubled, so one heavily
+    repeated incident cannot cut the ranking short: fewer than k pairs
+    means every row was a candidate.
+    Returns (index, score) pairs.
+    """
+    if len(vectors) == 0:
+        return []
+
+    scores = vectors @ query_vec
+    pool = pool_size_for(k, pool_size)
+
+    while True:
+        cand = top_candidates(scores, pool)
+        position = {int(i): p for p, i in enumerate(cand)}
+        ranked = rank_candidates(
+            scores[cand], vectors[cand], k, lam, threshold,
+            [position[i] for i in seed if i in position],
+        )
+        if len(ranked) >= k or len(cand) == len(vectors):
+            break
+        pool *= 2
+
+    return [(int(cand[p]), float(scores[cand[p]])) for p in ranked]
@@ -0,0 +1,449 @@
+import base64
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from record_store import load_records
+from retrieval import count_near, normalize_rows, pool_size_for, rank_candidates, top_candidates
+
+# ---------------- LAYOUT ----------------
+
+SHARD_PATTERN = "shard-*.jsonl"
+CLUSTERS_NAME = "clusters.json"   # build_clusters.py output, next to the index
+SHARD_TIMEOUT = 10
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# ---------------------------------------
+
+
+def shard_for(record_id: str, metadata: dict, n_shards: int, by: str = "hash") -> int:
+    """
+    Stable shard assignment: by record id hash, or by service so one
+    service's logs stay together.
+    """
+    if by == "service":
+        key = metadata.get("service", "")
+    elif by == "hash":
+        key = record_id
+    else:
+        raise ValueError(f"Unknown shard key: {by}")
+
+    digest = hashlib.md5(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % n_shards
+
+
+def shard_path(index_file: str, shard: int) -> str:
+    return os.path.join(os.path.dirname(index_file), f"shard-{shard:02d}.jsonl")
+
+
+def clusters_path(index_file: str) -> str:
+    return os.path.join(os.path.dirname(index_file), CLUSTERS_NAME)
+
+
+def index_files(index_file: str):
+    """
+    The single index file if present, otherwise its shard files.
+    """
+    if os.path.exists(index_file):
+        return [index_file]
+    return sorted(glob.glob(os.path.join(os.path.dirname(index_file), SHARD_PATTERN)))
+
+
+def clear_index(index_file: str):
+    """
+    Remove the single index file, any shard files next to it and the
+    clusters built from them (their representatives name old record
+    ids). Returns the paths removed.
+    """
+    removed = []
+    paths = [index_file, clusters_path(index_file)]
+    paths += glob.glob(os.path.join(os.path.dirname(index_file), SHARD_PATTERN))
+
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+def encode_vectors(vectors) -> str:
+    return base64.b64encode(np.ascontiguousarray(vectors, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vectors(data: str, dim: int) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).reshape(-1, dim)
+
+
+def load_index(paths, dim: int):
+    store, vectors = load_records(paths, dim)
+    return store, normalize_rows(vectors)
+
+# ---------------- BUILD ----------------
+
+_EMBEDDER = None
+
+
+def write_index(path, records, text_fn, batch_size):
+    """
+    Embed (id, metadata) pairs in batches and write them as JSONL.
+    """
+    global _EMBEDDER
+    if _EMBEDDER is None:
+        # Imported here so search workers importing this module skip torch
+        from sentence_transformers import SentenceTransformer
+        _EMBEDDER = SentenceTransformer(EMBEDDING_MODEL)
+
+    texts = [text_fn(meta) for _, meta in records]
+    vectors = _EMBEDDER.encode(texts, batch_size=batch_size) if texts else []
+
+    with open(path, "w", encoding="utf-8") as out:
+        for (record_id, meta), vector in zip(records, vectors):
+            record = {
+                "id": record_id,
+                "vector": vector.tolist(),
+                "metadata": meta
+            }
+            out.write(json.dumps(record) + "\n")
+
+    return len(records)
+
+
+def build_index(index_file, records, text_fn, n_shards=1, by="hash",
+                workers=1, batch_size=64):
+    """
+    Embed (id, metadata) records into index_file, or into n_shards shard
+    files next to it. Everything is written under temporary names first;
+    the previous layout is only replaced once every file is complete, so
+    a failed build leaves the old index in place.
+    Returns [(path, count)].
+    """
+    if n_shards <= 1:
+        jobs = [(index_file, records)]
+    else:
+        shards = [[] for _ in range(n_shards)]
+        for record_id, meta in records:
+            shards[shard_for(record_id, meta, n_shards, by)].append((record_id, meta))
+        jobs = [(shard_path(index_file, k), recs) for k, recs in enumerate(shards)]
+
+    args = [(f"{path}.tmp", recs, text_fn, batch_size) for path, recs in jobs]
+
+    try:
+        if workers > 1:
+            # spawn: each worker loads its own model instead of forking torch
+            with multiprocessing.get_context("spawn").Pool(workers) as pool:
+                counts = pool.starmap(write_index, args)
+        else:
+            counts = [write_index(*a) for a in args]
+    except BaseException:
+        for tmp, *_ in args:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+
+    for path in clear_index(index_file):
+        print(f"Removed old index file {path}")
+    for (path, _), (tmp, *_) in zip(jobs, args):
+        os.replace(tmp, path)
+
+    return [(path, count) for (path, _), count in zip(jobs, counts)]
+
+# ---------------- SHARD SIDE ----------------
+
+def shard_hits(store, vectors, query_vec, pool):
+    """
+    Shard-local candidates: the pool best-scoring rows with their ids,
+    row numbers and vectors. Duplicate collapsing and MMR run once on
+    the coordinator, so the merged result matches an unsharded search;
+    metadata is only fetched for the page being served.
+    """
+    if len(vectors) == 0:
+        return []
+
+    scores = vectors @ query_vec
+
+    return [
+        {
+            "id": store.record_id(i),
+            "score": float(scores[i]),
+            "row": int(i),
+            "vector": vectors[i],
+        }
+        for i in top_candidates(scores, pool)
+    ]
+
+
+def shard_records(store, vectors, rows):
+    """
+    Ids, metadata and vectors of the given rows, for a page of hits.
+    """
+    if any(r < 0 or r >= len(vectors) for r in rows):
+        raise ValueError("Row out of range")
+
+    return [store.record_id(r) for r in rows], [store.metadata(r) for r in rows], vectors[rows]
+
+# ---------------- COORDINATOR ----------------
+
+def merge_hits(hits, k, lam, pool, threshold, seed_ids=()):
+    """
+    Keep the global top pool from the per-shard candidates, then
+    collapse near-duplicates and MMR re-rank into one top-k, keeping
+    seed_ids (an earlier ranking) as the prefix.
+    """
+    if not hits:
+        return []
+
+    hits = sorted(hits, key=lambda h: -h["score"])[:pool]
+    scores = np.array([h["score"] for h in hits], dtype=np.float32)
+    vectors = np.array([h["vector"] for h in hits], dtype=np.float32)
+
+    position = {h["id"]: p for p, h in enumerate(hits)}
+    seed = [position[i] for i in seed_ids if i in position]
+
+    return [hits[p] for p in rank_candidates(scores, vectors, k, lam, threshold, seed)]
+
+
+def search_shards(fetch, k, lam, pool_size, threshold, seed_ids=()):
+    """
+    Scatter-gather search. fetch(pool) returns each answering shard's
+    top-pool candidates (one list per shard) and whether every shard
+    answered. As in search_matrix, the pool doubles while it collapses
+    into fewer than k distinct events and some shard may hold more rows.
+    Returns (hits, complete); hits keep their shard and row, not vectors.
+    """
+    pool = pool_size_for(k, pool_size)
+
+    while True:
+        per_shard, complete = fetch(pool)
+        hits = [h for shard in per_shard for h in shard]
+        merged = merge_hits(hits, k, lam, pool, threshold, seed_ids)
+
+        scanned = all(len(shard) < pool for shard in per_shard) and len(hits) <= pool
+        if len(merged) >= k or scanned:
+            break
+        pool *= 2
+
+    return [{key: h[key] for key in ("id", "score", "shard", "row")} for h in merged], complete
+
+
+def attach_records(hits, records):
+    """
+    Fill in metadata and vectors from per-shard shard_records results
+    (rows requested in hit order). Hits whose shard did not answer, or
+    whose row now holds another record, are dropped.
+    Returns (hits, complete).
+    """
+    taken = dict.fromkeys(records, 0)
+    attached = []
+
+    for hit in hits:
+        data = records.get(hit["shard"])
+        if data is None:
+            continue
+
+        ids, metadata, vectors = data
+        j = taken[hit["shard"]]
+        taken[hit["shard"]] += 1
+        if ids[j] != hit["id"]:
+            continue
+
+        hit["metadata"] = metadata[j]
+        hit["vector"] = vectors[j]
+        attached.append(hit)
+
+    return attached, len(attached) == len(hits)
+
+
+def rows_by_shard(hits):
+    rows = {}
+    for hit in hits:
+        rows.setdefault(hit["shard"], []).append(hit["row"])
+    return rows
+
+
+def collect(futures, labels):
+    """
+    Results by shard for the shards that answered, and whether all did.
+    """
+    results = {}
+    for shard, future in futures.items():
+        try:
+            results[shard] = future.result()
+        except Exception as e:
+            # Degrade to the shards that answered
+            print(f"⚠️ Shard {labels[shard]} failed: {e}")
+    return results, len(results) == len(futures)
+
+# ---------------- WORKER PROCESSES ----------------
+
+_WORKER_STORE = None
+_WORKER_VECTORS = None
+
+
+def _init_worker(path: str, dim: int):
+    global _WORKER_STORE, _WORKER_VECTORS
+    _WORKER_STORE, _WORKER_VECTORS = load_index([path], dim)
+
+
+def _worker_size() -> int:
+    return len(_WORKER_VECTORS)
+
+
+def _worker_search(query_vec, pool):
+    return shard_hits(_WORKER_STORE, _WORKER_VECTORS, query_vec, pool)
+
+
+def _worker_records(rows):
+    return shard_records(_WORKER_STORE, _WORKER_VECTORS, rows)
+
+
+def _worker_count(targets, threshold):
+    return count_near(_WORKER_VECTORS, targets, threshold)
+
+
+class ProcessShards:
+    """
+    One single-process pool per shard file; each worker keeps its shard
+    resident and queries are scattered to all of them in parallel.
+    """
+
+    def __init__(self, paths, dim: int):
+        # spawn: workers must not inherit the parent's torch state
+        ctx = multiprocessing.get_context("spawn")
+        self._paths = list(paths)
+        self._pools = [
+            ProcessPoolExecutor(
+                max_workers=1, mp_context=ctx,
+                initializer=_init_worker, initargs=(path, dim),
+            )
+            for path in self._paths
+        ]
+        # Force the workers to load their shards now rather than on first query
+        self._sizes = [f.result() for f in [p.submit(_worker_size) for p in self._pools]]
+
+    def size(self) -> int:
+        return sum(self._sizes)
+
+    def close(self):
+        for pool in self._pools:
+            pool.shutdown(wait=True)
+
+    def _scatter(self, fn, args_by_shard):
+        futures = {
+            s: self._pools[s].submit(fn, *args)
+            for s, args in args_by_shard.items()
+        }
+        return collect(futures, self._paths)
+
+    def search(self, query_vec, k, lam, pool_size, threshold, seed_ids=()):
+        def fetch(pool):
+            results, complete = self._scatter(
+                _worker_search, dict.fromkeys(range(len(self._pools)), (query_vec, pool))
+            )
+            for s, hits in results.items():
+                for hit in hits:
+                    hit["shard"] = s
+            return list(results.values()), complete
+
+        return search_shards(fetch, k, lam, pool_size, threshold, seed_ids)
+
+    def records(self, hits):
+        rows = rows_by_shard(hits)
+        results, _ = self._scatter(_worker_records, {s: (r,) for s, r in rows.items()})
+        return attach_records(hits, results)
+
+    def count(self, targets, threshold):
+        results, complete = self._scatter(
+            _worker_count, dict.fromkeys(range(len(self._pools)), (targets, threshold))
+        )
+        return sum(results.values(), np.zeros(len(targets), dtype=np.int64)), complete
+
+
+class RemoteShards:
+    """
+    Scatter-gather over other API instances, each serving one shard
+    through the /shard/* routes.
+    """
+
+    def __init__(self, urls, dim: int):
+        self._urls = [u.rstrip("/") for u in urls]
+        self._dim = dim
+        # requests.Session is not thread-safe: one per executor thread
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=len(self._urls))
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _call(self, shard, path, payload):
+        url = f"{self._urls[shard]}{path}"
+        if payload is None:
+            r = self._session().get(url, timeout=SHARD_TIMEOUT)
+        else:
+            r = self._session().post(url, json=payload, timeout=SHARD_TIMEOUT)
+        r.raise_for_status()
+        return r.json()
+
+    def _gather(self, path, payloads):
+        """
+        Call shards in parallel, payloads mapping shard number to its
+        payload (None for a GET); shards that fail are skipped.
+        Returns ({shard: response}, complete).
+        """
+        futures = {
+            s: self._executor.submit(self._call, s, path, payload)
+            for s, payload in payloads.items()
+        }
+        return collect(futures, self._urls)
+
+    def _all(self, payload):
+        return dict.fromkeys(range(len(self._urls)), payload)
+
+    def size(self) -> int:
+        results, _ = self._gather("/shard/info", self._all(None))
+        return sum(r["vectors_loaded"] for r in results.values())
+
+    def search(self, query_vec, k, lam, pool_size, threshold, seed_ids=()):
+        def fetch(pool):
+            payload = {"vector": encode_vectors(query_vec[None]), "pool": pool}
+            results, complete = self._gather("/shard/search", self._all(payload))
+
+            per_shard = []
+            for s, r in results.items():
+                vectors = decode_vectors(r["vectors"], self._dim)
+                for hit, vector in zip(r["hits"], vectors):
+                    hit["shard"] = s
+                    hit["vector"] = vector
+                per_shard.append(r["hits"])
+            return per_shard, complete
+
+        return search_shards(fetch, k, lam, pool_size, threshold, seed_ids)
+
+    def records(self, hits):
+        payloads = {s: {"rows": rows} for s, rows in rows_by_shard(hits).items()}
+        results, _ = self._gather("/shard/records", payloads)
+
+        records = {
+            s: (r["ids"], r["metadata"], decode_vectors(r["vectors"], self._dim))
+            for s, r in results.items()
+        }
+        return attach_records(hits, records)
+
+    def count(self, targets, threshold):
+        payload = {"vectors": encode_vectors(targets), "threshold": threshold}
+        results, complete = self._gather("/shard/count", self._all(payload))
+
+        counts = np.zeros(len(targets), dtype=np.int64)
+        for r in results.values():
+            counts += np.asarray(r["counts"], dtype=np.int64)
+        return counts, complete
@@ -1,9 +1,23 @@
+import html
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 
 # ---------------- CONFIG ----------------
 
-API_URL = "http://lograg-api:8000/explain"
+API_BASE_URL = "http://lograg-api:8000"
+SEARCH_URL = f"{API_BASE_URL}/search"
+EXPLAIN_URL = f"{API_BASE_URL}/explain"
+
+SEARCH_TIMEOUT = 15
+EXPLAIN_TIMEOUT = 120
+PAGE_SIZES = [5, 10, 25, 50]
+SEARCH_CACHE_TTL = 300   # seconds a fetched result page is reused
+EXPLAIN_POLL_SECONDS = 0.5   # how often a pending explanation is checked
 
 
 # ---------------- PAGE SETUP ----------------
@@ -14,6 +28,130 @@ st.set_page_config(
     layout="centered"
 )
 
+# ---------------- HTTP ----------------
+
+def new_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Pooled keep-alive session for this browser session. Every rerun
+    runs on a new thread, so it lives in session_state; one user's
+    reruns never overlap.
+    """
+    if "http_session" not in st.session_state:
+        st.session_state.http_session = new_session()
+    return st.session_state.http_session
+
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    # Runs /explain in the background while search results render
+    return ThreadPoolExecutor(max_workers=4)
+
+
+@st.cache_resource
+def get_worker_sessions() -> threading.local:
+    # requests.Session is not thread-safe; executor threads are
+    # long-lived, so each keeps its own
+    return threading.local()
+
+
+def post_json(session: requests.Session, url: str, payload: dict, timeout: int) -> dict:
+    response = session.post(url, json=payload, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"Backend error {response.status_code}: {response.text}")
+    return response.json()
+
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, show_spinner=False)
+def fetch_search_page(query: str, offset: int, limit: int, _session: requests.Session) -> dict:
+    return post_json(
+        _session,
+        SEARCH_URL,
+        {"query": query, "offset": offset, "top_k": limit},
+        SEARCH_TIMEOUT,
+    )
+
+
+def fetch_explanation(query: str, sessions: threading.local) -> dict:
+    # Runs on an executor thread, so it cannot use session_state
+    if not hasattr(sessions, "session"):
+        sessions.session = new_session()
+    return post_json(sessions.session, EXPLAIN_URL, {"query": query}, EXPLAIN_TIMEOUT)
+
+# ---------------- RENDERING ----------------
+
+def render_log_cards(results) -> str:
+    """
+    Build the HTML for a whole page of results so it is sent to the
+    browser in a single st.markdown call.
+    """
+    cards = []
+    for log in results:
+        meta = log.get("metadata", {})
+        score = log.get("score", 0)
+        occurrences = log.get("occurrences", 1)
+
+        repeated = ""
+        if occurrences > 1:
+            repeated = f"""
+            <div><span class="meta">Similar occurrences:</span>
+            <span class="value"> {occurrences}</span></div>"""
+
+        cards.append(f"""
+        <div class="card">
+            <div><span class="meta">Service:</span>
+            <span class="value"> {html.escape(str(meta.get("service", "N/A")))}</span></div>
+
+            <div><span class="meta">Level:</span>
+            <span class="value"> {html.escape(str(meta.get("level", "N/A")))}</span></div>
+
+            <div><span class="meta">Message:</span>
+            <span class="value"> {html.escape(str(meta.get("message", "N/A")))}</span></div>
+
+            <div><span class="meta">Timestamp:</span>
+            <span class="value"> {html.escape(str(meta.get("timestamp", "N/A")))}</span></div>
+
+            <div><span class="meta">Similarity score:</span>
+            <span class="value"> {round(score, 3)}</span></div>{repeated}
+        </div>
+        """)
+
+    return "".join(cards)
+
+
+def render_explanation(data: dict):
+    explanation = data.get("llm_explanation", "")
+
+    if explanation:
+        source = ""
+        if data.get("source") == "cluster":
+            source = " · pre-computed for a recurring incident"
+        elif data.get("source") == "cache":
+            source = " · cached"
+
+        st.markdown("""
+        <div class="card">
+            <div class="section-title">📌 AI Incident Analysis""" + source + """</div>
+        """ + html.escape(explanation).replace("\n", "<br>") + """
+        </div>
+        """, unsafe_allow_html=True)
+
+    else:
+        reason = html.escape(data.get("reason", "LLM is currently offline."))
+        st.markdown("""
+        <div class="card">
+            <div class="section-title">📌 Explanation unavailable</div>
+            """ + reason + """ Relevant historical logs are shown below.
+        </div>
+        """, unsafe_allow_html=True)
+
 # ---------------- STYLES ----------------
 
 st.markdown("""
@@ -114,84 +252,96 @@ query = st.text_area(
     placeholder="Example: Auth service keeps crashing with exit code 137"
 )
 
+col_mode, col_size = st.columns([3, 1])
+with col_mode:
+    mode = st.radio(
+        "Mode",
+        ["Search + explain", "Search only"],
+        horizontal=True,
+    )
+with col_size:
+    page_size = st.selectbox("Logs per page", PAGE_SIZES, index=1)
+
 # ---------------- ACTION ----------------
 
+state = st.session_state
+
 if st.button("Explain issue 🚀"):
 
     if not query.strip():
         st.warning("Please enter a log or issue description.")
     else:
-        with st.spinner("Analyzing logs and generating explanation…"):
-            try:
-                response = requests.post(
-                    API_URL,
-                    json={"query": query},
-                    timeout=120
-                )
-
-                if response.status_code != 200:
-                    st.error("Backend error")
-                    st.code(response.text)
-                else:
-                    data = response.json()
-
-                    llm_used = data.get("llm_used", False)
-                    explanation = data.get("llm_explanation", "")
-                    similar_logs = data.get("similar_logs", [])
-                    reason = data.get("reason", "")
-
-                    
-
-                    # -------- AI EXPLANATION --------
-
-                    if explanation:
-                        st.markdown("""
-                        <div class="card">
-                            <div class="section-title">📌 AI Incident Analysis</div>
-                        """ + explanation.replace("\n", "<br>") + """
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                    elif not llm_used:
-                        st.markdown("""
-                        <div class="card">
-                            <div class="section-title">📌 Explanation unavailable</div>
-                            LLM is currently offline. Relevant historical logs are shown below.
-                        </div>
-                        """, unsafe_allow_html=True)
-
-                    # -------- RELEVANT LOGS --------
-
-                    if similar_logs:
-                        st.markdown("### 📄 Relevant Historical Logs")
-
-                        for log in similar_logs:
-                            meta = log.get("metadata", {})
-                            score = log.get("score", 0)
-
-                            st.markdown(f"""
-                            <div class="card">
-                                <div><span class="meta">Service:</span>
-                                <span class="value"> {meta.get("service", "N/A")}</span></div>
-
-                                <div><span class="meta">Level:</span>
-                                <span class="value"> {meta.get("level", "N/A")}</span></div>
-
-                                <div><span class="meta">Timestamp:</span>
-                                <span class="value"> {meta.get("timestamp", "N/A")}</span></div>
-
-                                <div><span class="meta">Similarity score:</span>
-                                <span class="value"> {round(score, 3)}</span></div>
-                            </div>
-                            """, unsafe_allow_html=True)
-
-            except requests.exceptions.ConnectionError:
-                st.error("API not reachable. Is FastAPI running?")
-            except requests.exceptions.Timeout:
-                st.error("Request timed out. LLM may be busy.")
-            except Exception as e:
-                st.error("Unexpected error")
-                st.exception(e)
+        state.active_query = query
+        state.offset = 0
+        state.explain_future = None
+        state.explanation = None
+
+        if mode == "Search + explain":
+            # Start the slow LLM call now; search results render meanwhile
+            state.explain_future = get_executor().submit(
+                fetch_explanation, query, get_worker_sessions()
+            )
+
+active_query = state.get("active_query")
+
+if active_query:
+    explanation_slot = st.empty()
+
+    # -------- RELEVANT LOGS --------
+
+    try:
+        page = fetch_search_page(active_query, state.offset, page_size, get_session())
+        similar_logs = page.get("results", [])
+
+        if page.get("partial"):
+            st.warning("Some index shards did not answer; results may be incomplete.")
+
+        if similar_logs:
+            st.markdown("### 📄 Relevant Historical Logs")
+            st.markdown(render_log_cards(similar_logs), unsafe_allow_html=True)
+
+            col_prev, col_info, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if state.offset > 0 and st.button("⬅ Previous"):
+                    state.offset = max(0, state.offset - page_size)
+                    st.rerun()
+            with col_info:
+                first = state.offset + 1
+                st.caption(f"Showing {first}–{state.offset + len(similar_logs)}")
+            with col_next:
+                if page.get("has_more") and st.button("Next ➡"):
+                    state.offset += page_size
+                    st.rerun()
+        else:
+            st.info("No similar logs found.")
+
+    except requests.exceptions.ConnectionError:
+        st.error("API not reachable. Is FastAPI running?")
+    except requests.exceptions.Timeout:
+        st.error("Search timed out.")
+    except Exception as e:
+        st.error("Unexpected error")
+        st.exception(e)
+
+    # -------- AI EXPLANATION --------
+
+    future = state.get("explain_future")
+
+    if future is not None and state.explanation is None and future.done():
+        try:
+            state.explanation = future.result()
+        except requests.exceptions.ConnectionError:
+            state.explanation = {"reason": "API not reachable."}
+        except requests.exceptions.Timeout:
+            state.explanation = {"reason": "Request timed out. LLM may be busy."}
+        except Exception as e:
+            state.explanation = {"reason": str(e)}
+
+    if state.get("explanation") is not None:
+        with explanation_slot.container():
+            render_explanation(state.explanation)
+    elif future is not None:
+        explanation_slot.info("⏳ Generating explanation…")
 
 # ---------------- FOOTER ----------------
 
@@ -201,3 +351,10 @@ st.markdown("""
 FastAPI · SentenceTransformers · Ollama · Secure Local RAG
 </small>
 """, unsafe_allow_html=True)
+
+# Poll a pending explanation without blocking: paging clicks made while
+# it runs are picked up on the next rerun
+pending = state.get("explain_future")
+if active_query and pending is not None and state.get("explanation") is None:
+    time.sleep(EXPLAIN_POLL_SECONDS)
+    st.rerun()